@@ -1,9 +1,7 @@
 #!/usr/bin/env python3
-import os
 import requests
 import logging
 import sys
-import json
 from pathlib import Path
 from typing import List, Dict
 
@@ -11,14 +9,26 @@ from typing import List, Dict
 class UserApiClient:
     """Simple client class for making GET requests to OSG Connect Database"""
 
-    def __init__(self, token_file_path: Path):
+    def __init__(self, token_file_path: Path, pool_size: int = 16):
         """Constructor
 
         :param token_file_path: path to file containing API token
         :type token_file_path: str
+        :param pool_size: number of connections to keep open to the API, should match the number of threads making requests, defaults to 16
+        :type pool_size: int, optional
         """
         self.log = logging.getLogger("Client")
         self.url_prefix = "https://api.ci-connect.net:18080/v1alpha1"
+
+        # reuse connections (and TLS sessions) across requests instead of
+        # opening a new one for every GET
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size
+        )
+        self._session.mount("https://", adapter)
+
         try:
             with token_file_path.open("r") as f:
                 self._token = f.read().strip()
@@ -35,7 +45,7 @@ class UserApiClient:
         :rtype: Dict
         :raises requests.exceptions.HTTPError: encountered 4XX client error or 5XX server error response
         """
-        resp = requests.get("{}{}?token={}".format(
+        resp = self._session.get("{}{}?token={}".format(
                 self.url_prefix, route, self._token
             ))
 
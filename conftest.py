@@ -0,0 +1,2 @@
+# keeps the top level directory on sys.path so the tests can import the
+# modules under test when run with a bare `pytest`
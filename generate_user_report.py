@@ -1,26 +1,81 @@
 #!/usr/bin/env python3
 import json
 import logging
+import re
 import sys
 import smtplib
 import argparse
 
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 from datetime import datetime
 from datetime import timezone
 from email.mime.text import MIMEText
 from enum import Enum
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Set, Union, Tuple
+from typing import AbstractSet, Dict, FrozenSet, Iterable, Iterator, List, Optional, Union, Tuple
 
 from client import UserApiClient
 
+import orjson
 from tqdm import tqdm
 
+TOP_DIR = Path(__file__).resolve().parent
+SNAPSHOT_DIR = TOP_DIR / "snapshots"
+
 DATE_FMT = "%Y-%b-%d %H:%M:%S.%f %Z"
 
+# lexicographically sortable (ISO 8601) form of DATE_FMT, always in UTC
+ISO_DATE_FMT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# snapshots are written with "date" as their first key
+SNAPSHOT_DATE_RE = re.compile(r'^\{\s*"date"\s*:\s*"([^"]*)"')
+
+# name of snapshot files written by get_snapshot
+SNAPSHOT_FILE_RE = re.compile(r"^\d{8}_snapshot\.json$")
+
+# values of "kind" given to user objects by the API
+USER_KINDS = frozenset({"User", "user"})
+
+# account used to send reports
+EMAIL_USER = "osg.user.reporting@gmail.com"
+
+# max number of concurrent requests made to the OSG Connect User Database
+MAX_API_WORKERS = 16
+
 log = logging.getLogger("reporter")
 
+@lru_cache(maxsize=None)
+def parse_date(date: str) -> datetime:
+    """
+    Parses a date formatted as ISO_DATE_FMT or DATE_FMT. Results are cached as
+    the same join dates are parsed repeatedly across snapshots and report functions.
+
+    :param date: date such as "2021-01-01T00:00:00.000000" or "2021-Jan-01 00:00:00.000000 UTC"
+    :type date: str
+    :return: parsed date
+    :rtype: datetime
+    """
+    # fromisoformat is implemented in C and much faster than strptime, which
+    # is still needed for join dates from the API and older snapshots
+    try:
+        return datetime.fromisoformat(date)
+    except ValueError:
+        return datetime.strptime(date, DATE_FMT)
+
+def to_iso_date(date: str) -> str:
+    """
+    Converts a date formatted as DATE_FMT (or ISO_DATE_FMT) to ISO_DATE_FMT so
+    that it can be compared to other dates as a plain string.
+
+    :param date: date such as "2021-Jan-01 00:00:00.000000 UTC"
+    :type date: str
+    :return: date such as "2021-01-01T00:00:00.000000"
+    :rtype: str
+    """
+    return parse_date(date).strftime(ISO_DATE_FMT)
+
 class GroupMemberState(Enum):
     """Possible group membership states"""
     NONMEMBER = "nonmember"
@@ -29,6 +84,32 @@ class GroupMemberState(Enum):
     ADMIN = "admin"
     DISABLED = "disabled"
 
+# interned like the group names of loaded snapshots, see snapshot_from_dict
+ROOT_OSG_GROUP = sys.intern("root.osg")
+
+# group states that count as having been added to a group
+ACTIVE_OR_PENDING = frozenset({GroupMemberState.ACTIVE.value, GroupMemberState.PENDING.value})
+
+# groups that are neither training nor non-training projects
+DEFAULT_EXCLUDED_GROUPS = frozenset({
+    "root",
+    "root.osg",
+    "root.osg.login-nodes",
+    "root.osg.login-nodes.login05",
+    "root.osg.login-nodes.login04"
+})
+
+@dataclass(slots=True, frozen=True)
+class UserRecord:
+    """In memory representation of a user's entry in a snapshot"""
+    # kept as a dict rather than parallel (names, states) tuples: root.osg state
+    # is looked up by name for every user, and filtering by state is done once
+    # per snapshot by build_active_group_index
+    groups: Dict[str, str] = field(default_factory=dict)
+    osg_state: Optional[str] = None
+    join_date: Optional[str] = None
+    join_date_iso: Optional[str] = None
+
 def get_snapshot(save=True) -> dict:
     """
     Dump a snapshot of the data base into ./snapshots/YYYYMMDD_snapshot.json
@@ -44,11 +125,12 @@ def get_snapshot(save=True) -> dict:
 
     The snapshot is formatted as follows:
     {
-        "date": "YYYY-Mon-DD HH:MM:SS.MS UTC",
+        "date": "YYYY-MM-DDTHH:MM:SS.MS",
         "users": {
             "<user_name>": {
                 "osg_state": "<active | pending | ...>",
                 "joing_date": "YYYY-Mon-DD HH:MM:SS.MS UTC",
+                "join_date_iso": "YYYY-MM-DDTHH:MM:SS.MS",
                 "groups": {
                     "<group_name>": "<active | pending | ...>",
                     ...
@@ -57,84 +139,253 @@ def get_snapshot(save=True) -> dict:
         }
     }
 
+    The snapshot is returned with its users given as UserRecords (see
+    snapshot_from_dict), as if it had been read back with load_snapshot.
+
     :param save: whether or not to save snapshot to disk, defaults to True
     :type save: bool
-    :return: snapshot just written
+    :return: snapshot just written, with users given as UserRecords
     :rtype: dict
     """
-    TOP_DIR = Path(__file__).parent.resolve()
-    client = UserApiClient(TOP_DIR / "token_DO_NOT_VERSION")
+    client = UserApiClient(TOP_DIR / "token_DO_NOT_VERSION", pool_size=MAX_API_WORKERS)
     
-    snapshot = defaultdict(dict)
-
     # get the state of all users in the root.osg group
     osg_states = client.get_group_members("root.osg")
-    for s in osg_states:
-        snapshot[s["user_name"]]["osg_state"] = s["state"]
+    snapshot = {
+        s["user_name"]: {"osg_state": s["state"], "groups": dict()}
+        for s in osg_states
+    }
 
     # get the join date of all users (it is expected that all users belong to root.osg)
     users = client.get_users()
     for u in users:
-        if u["kind"].lower() == "user" and u["metadata"]["unix_name"] in snapshot:
-            u = u["metadata"]
-            snapshot[u["unix_name"]]["join_date"] = u["join_date"]
+        if u["kind"] in USER_KINDS:
+            metadata = u["metadata"]
+            user_entry = snapshot.get(metadata["unix_name"])
 
-    # get the membership information from each group (len(groups) number of api requests...)
-    groups = client.get_group_list()
-    for group_name in tqdm(groups):
-        # only concerned with groups that are part of "root.osg"
-        if "root.osg" in group_name:
-            memberships = client.get_group_members(group_name)
-            for m in memberships:
-                if "groups" not in snapshot[m["user_name"]]:
-                    snapshot[m["user_name"]]["groups"] = dict()
+            if user_entry is not None:
+                user_entry["join_date"] = metadata["join_date"]
+                user_entry["join_date_iso"] = to_iso_date(metadata["join_date"])
 
-                snapshot[m["user_name"]]["groups"][group_name] = m["state"]
+    # get the membership information from each group (len(groups) number of api requests...)
+    # only concerned with groups that are part of "root.osg"
+    groups = [g for g in client.get_group_list() if "root.osg" in g]
+
+    # requests are I/O bound, so fan them out over a thread pool; results are
+    # merged into the snapshot here on the main thread as they come in
+    with ThreadPoolExecutor(max_workers=MAX_API_WORKERS) as executor:
+        futures = {
+            executor.submit(client.get_group_members, group_name): group_name
+            for group_name in groups
+        }
 
-    log.info("collected {num} users in the root.osg group".format(num=len(snapshot)))
+        try:
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                group_name = futures[future]
+                for m in future.result():
+                    user_entry = snapshot.get(m["user_name"])
+
+                    # members of a root.osg subgroup that are not in root.osg itself
+                    if user_entry is None:
+                        user_entry = snapshot[m["user_name"]] = {"groups": dict()}
+
+                    user_entry["groups"][group_name] = m["state"]
+        except BaseException:
+            # fail fast instead of waiting on every request still queued
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    log.info("collected %d users in the root.osg group", len(snapshot))
+
+    # order users by join date so that new account requests are found at the
+    # end of the snapshot, see _iter_users_joined_between
+    snapshot = dict(sorted(
+        snapshot.items(),
+        key=lambda item: item[1].get("join_date_iso", "")
+    ))
 
     # add date snapshot was recorded 
     snapshot = {
-        "date": datetime.now(timezone.utc).strftime(DATE_FMT),
+        "date": datetime.now(timezone.utc).strftime(ISO_DATE_FMT),
         "users": snapshot
     }
 
     # setup directory for snapshot files
-    snapshot_dir = TOP_DIR / "snapshots"
-    snapshot_dir.mkdir(exist_ok=True)
+    SNAPSHOT_DIR.mkdir(exist_ok=True)
 
     snapshot_file = "{date}_snapshot.json".format(date=datetime.now().strftime("%Y%m%d"))
-    snapshot_file = snapshot_dir / snapshot_file
+    snapshot_file = SNAPSHOT_DIR / snapshot_file
+
+    dump_snapshot(snapshot, snapshot_file)
+
+    log.info("snapshot written to %s", snapshot_file)
+
+    return snapshot_from_dict(snapshot)
+
+def dump_snapshot(snapshot: dict, snapshot_file: Path) -> None:
+    """
+    Writes the given snapshot to disk one user per line so that the serialized
+    form of the whole snapshot is never held in memory at once. "date" is
+    always written as the first key.
+
+    :param snapshot: snapshot to write
+    :type snapshot: dict
+    :param snapshot_file: path to write the snapshot to
+    :type snapshot_file: Path
+    """
+    with snapshot_file.open("wb") as f:
+        f.write(b'{"date":' + orjson.dumps(snapshot["date"]) + b',"users":{')
+
+        sep = b"\n"
+        for u_name, u_info in snapshot["users"].items():
+            f.write(sep + orjson.dumps(u_name) + b":" + orjson.dumps(u_info))
+            sep = b",\n"
+
+        f.write(b"\n}}\n")
+
+def snapshot_from_dict(snapshot: dict) -> dict:
+    """
+    Converts each user entry of a snapshot, as written to disk, into a
+    UserRecord. A UserRecord takes up a fraction of the memory of the dict it
+    replaces, which adds up over every user in a snapshot.
+
+    Group names and states are interned so that looking them up or comparing
+    them to constants such as ROOT_OSG_GROUP is an identity check. join_date_iso
+    is filled in for snapshots taken before it was recorded so that join dates
+    never need to be parsed after loading. Whether users are ordered by join
+    date is recorded under "users_sorted_by_join_date" (snapshots taken before
+    get_snapshot sorted them are not).
+
+    :param snapshot: snapshot with users given as dicts
+    :type snapshot: dict
+    :return: snapshot with users given as UserRecords
+    :rtype: dict
+    """
+    users = dict()
+    users_sorted_by_join_date = True
+    prev_join_date = ""
+
+    for u_name, u_info in snapshot["users"].items():
+        osg_state = u_info.get("osg_state")
+        join_date = u_info.get("join_date")
+        join_date_iso = u_info.get("join_date_iso")
+
+        if join_date is not None and join_date_iso is None:
+            join_date_iso = to_iso_date(join_date)
+
+        users[u_name] = UserRecord(
+            # share one string object per group name and state rather than
+            # one per membership
+            groups={
+                sys.intern(group_name): sys.intern(state)
+                for group_name, state in u_info.get("groups", dict()).items()
+            },
+            osg_state=sys.intern(osg_state) if osg_state is not None else None,
+            join_date=join_date,
+            join_date_iso=join_date_iso
+        )
+
+        if (join_date_iso or "") < prev_join_date:
+            users_sorted_by_join_date = False
+        prev_join_date = join_date_iso or ""
+
+    return {
+        "date": snapshot["date"],
+        "users": users,
+        "users_sorted_by_join_date": users_sorted_by_join_date
+    }
+
+def load_snapshot(snapshot_file: Path) -> dict:
+    """
+    Loads the given snapshot file.
+
+    :param snapshot_file: path to the snapshot file
+    :type snapshot_file: Path
+    :return: snapshot with users given as UserRecords
+    :rtype: dict
+    :raises FileNotFoundError: given snapshot file could not be found
+    """
+    with snapshot_file.open("rb") as f:
+        return snapshot_from_dict(orjson.loads(f.read()))
+
+def compact_previous_snapshot(snapshot: dict) -> dict:
+    """
+    Drops everything from a snapshot that is not needed when it is used as the
+    previous snapshot of a report: the "root.osg" state of each user. This keeps
+    the previous snapshot's memory footprint proportional to the number of
+    users rather than the number of group memberships.
+
+    :param snapshot: previously recorded snapshot
+    :type snapshot: dict
+    :return: compacted snapshot
+    :rtype: dict
+    """
+    users = dict()
+    for u_name, u_info in snapshot["users"].items():
+        groups = u_info.groups
+        users[u_name] = UserRecord(
+            groups={ROOT_OSG_GROUP: groups[ROOT_OSG_GROUP]} if ROOT_OSG_GROUP in groups else dict()
+        )
+
+    return {"date": snapshot["date"], "users": users}
+
+def read_snapshot_date(snapshot_file: Path) -> str:
+    """
+    Returns the "date" field of the given snapshot file. Only the beginning of
+    the file is read as "date" is the first key written to a snapshot. Falls
+    back to loading the whole file if "date" cannot be found there.
+
+    :param snapshot_file: path to the snapshot file
+    :type snapshot_file: Path
+    :return: date the snapshot was recorded
+    :rtype: str
+    """
+    with snapshot_file.open("r") as f:
+        match = SNAPSHOT_DATE_RE.match(f.read(256))
 
-    with snapshot_file.open("w") as f:
-        json.dump(snapshot, f, indent=1)
+        if match:
+            return match.group(1)
 
-    log.info("snapshot written to {file}".format(file=snapshot_file))
+    return load_snapshot(snapshot_file)["date"]
 
-    return snapshot
+# ((./snapshots, names of the snapshot files in it), latest snapshot file) as of
+# the last lookup
+_latest_snapshot_cache = (None, None)
 
 def get_latest_snapshot_on_disk() -> Union[Path, None]:
     """
-    Returns the a path object to the latest snapshot file in ./snapshots.
+    Returns the a path object to the latest snapshot file in ./snapshots. The
+    result is cached until a file is added to or removed from ./snapshots.
 
     :return: path to the latest snapshot file or None if none is found
     :rtype: Union[Path, None]
     """
-    SNAPSHOT_DIR = Path(__file__).parent.resolve() / "snapshots"
+    global _latest_snapshot_cache
+
+    if not SNAPSHOT_DIR.is_dir():
+        return None
 
-    latest_snapshot_file = None
-    latest_snapshot_date = datetime.min
+    snapshot_files = [f for f in SNAPSHOT_DIR.iterdir() if f.name.endswith("_snapshot.json")]
 
-    if SNAPSHOT_DIR.is_dir():
-        for f in SNAPSHOT_DIR.iterdir():
-            if f.name.endswith("_snapshot.json"):
-                with f.open("r") as curr_snapshot_file:
-                    curr_snapshot_date = json.load(curr_snapshot_file)["date"]
-                    curr_snapshot_date = datetime.strptime(curr_snapshot_date, DATE_FMT)
+    # keyed on file names rather than the directory mtime, which is too coarse
+    # on some filesystems to tell apart files written in quick succession
+    cache_key = (SNAPSHOT_DIR, tuple(sorted(f.name for f in snapshot_files)))
+    if _latest_snapshot_cache[0] == cache_key:
+        return _latest_snapshot_cache[1]
+
+    # files written by get_snapshot are named YYYYMMDD_snapshot.json, so the
+    # latest one can be found by name without opening any of them
+    if all(SNAPSHOT_FILE_RE.match(f.name) for f in snapshot_files):
+        latest_snapshot_file = max(snapshot_files, key=lambda f: f.name, default=None)
+    else:
+        # otherwise fall back to the date recorded in each snapshot
+        latest_snapshot_file = max(
+            snapshot_files,
+            key=lambda f: parse_date(read_snapshot_date(f)),
+            default=None
+        )
 
-                    if curr_snapshot_date > latest_snapshot_date:
-                        latest_snapshot_date = curr_snapshot_date
-                        latest_snapshot_file = f
+    _latest_snapshot_cache = (cache_key, latest_snapshot_file)
 
     return latest_snapshot_file
 
@@ -143,74 +394,175 @@ def get_snapshot_on_disk(snapshot: str) -> dict:
 
     :param snapshot: name of the snapshot
     :type snapshot: str
-    :return: dict representation of the snapshot
+    :return: dict representation of the snapshot, see load_snapshot
     :rtype: dict
     :raises FileNotFoundError: given snapshot could not be found 
     """
-    SNAPSHOT_DIR = Path(__file__).parent.resolve() / "snapshots"
+    return load_snapshot(SNAPSHOT_DIR / snapshot)
+
+
+@lru_cache(maxsize=1)
+def get_email_password() -> str:
+    """
+    Returns the password to the email account used to send reports, read from
+    ./email_credentials_DO_NOT_VERSION. The file is only read the first time
+    this is called.
+
+    :return: email account password
+    :rtype: str
+    """
+    EMAIL_CREDENTIALS = TOP_DIR / "email_credentials_DO_NOT_VERSION"
+    with EMAIL_CREDENTIALS.open("r") as f:
+        return f.read().strip()
+
+class Mailer:
+    """
+    Sends emails over a single authenticated SMTP session, which is opened when
+    entering the context and closed when exiting it.
+    """
+
+    def __init__(self, host: str = "smtp.gmail.com", port: int = 465, user: str = EMAIL_USER):
+        """Constructor
+
+        :param host: SMTP server, defaults to "smtp.gmail.com"
+        :type host: str, optional
+        :param port: SMTP over SSL port, defaults to 465
+        :type port: int, optional
+        :param user: account to log in as, defaults to EMAIL_USER
+        :type user: str, optional
+        """
+        self.host = host
+        self.port = port
+        self.user = user
+        self._server = None
 
-    target_snapshot = SNAPSHOT_DIR / snapshot
+    def __enter__(self) -> "Mailer":
+        # implicit TLS instead of STARTTLS saves a round trip
+        self._server = smtplib.SMTP_SSL(self.host, self.port)
 
-    with target_snapshot.open("r") as f:
-        return json.load(f)
+        try:
+            self._server.login(self.user, get_email_password())
+        except BaseException:
+            # __exit__ is not called when __enter__ raises
+            self._server.close()
+            self._server = None
+            raise
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.quit()
+        self._server = None
 
+    def send(self, message: MIMEText) -> None:
+        """Sends the given message to the recipients in its headers
+
+        :param message: message to send
+        :type message: MIMEText
+        """
+        self._server.send_message(message)
 
 def send_report(recipients: List[str], msg_content: str) -> None:
 
     # TODO: parametrize email recipients.. (or load from file to keep from versioning)
     # TODO: needs exception/error handling
 
-    # get email credentials
-    EMAIL_CREDENTIALS = Path(__file__).parent.resolve() / "email_credentials_DO_NOT_VERSION"
-    with EMAIL_CREDENTIALS.open("r") as f:
-        pw = f.read().strip()
-    
-    title = 'My title'
     message = MIMEText(msg_content, 'html')
 
-    message['From'] = 'OSG <osg.user.reporting@gmail.com>'
+    message['From'] = 'OSG <{}>'.format(EMAIL_USER)
     message['To'] = ",".join(recipients)
     message['Subject'] = 'OSG Connect User Account Reporting'
 
-    msg_full = message.as_string()
-
-    server = smtplib.SMTP('smtp.gmail.com:587')
-    server.starttls()
-    server.login('osg.user.reporting@gmail.com', pw)
-    server.sendmail('osg.user.reporting@gmail.com', recipients, msg_full)
-    server.quit()
+    with Mailer() as mailer:
+        mailer.send(message)
 
-def get_training_groups() -> Set[str]:
+@lru_cache(maxsize=1)
+def get_training_groups() -> FrozenSet[str]:
     """
     Returns the list of training groups in ./training_groups.json as a set.
+    The file is only read the first time this is called.
 
     :return: training groups
-    :rtype: Set[str]
+    :rtype: FrozenSet[str]
     """
     try:
-        training_groups_file = Path(__file__).parent.resolve() / "training_groups.json"
+        training_groups_file = TOP_DIR / "training_groups.json"
         with training_groups_file.open("r") as f:
-            training_groups = set(json.load(f))
+            training_groups = frozenset(json.load(f))
 
-        log.info("found training groups: {tg} in {p}".format(
-            tg=training_groups,
-            p=training_groups_file
-        ))
+        log.info("found training groups: %s in %s", training_groups, training_groups_file)
 
         return training_groups
 
     except FileNotFoundError:
-        log.error("Unable to find {p}, no training groups set".format(
-            p=training_groups_file
-        ))
+        log.error("Unable to find %s, no training groups set", training_groups_file)
         raise
     except json.JSONDecodeError:
-        log.error("Unable to decode {p}, possible formatting error".format(p=training_groups_file))
+        log.error("Unable to decode %s, possible formatting error", training_groups_file)
         raise
     
 
 
 ### New Account Request Reporting ##############################################
+def _iter_users_joined_between(
+        snapshot: dict,
+        start_date: str,
+        end_date: Optional[str] = None
+    ) -> Iterator[Tuple[str, UserRecord]]:
+    """
+    Yields the users in the given snapshot that joined during
+    start_date < join_date <= end_date, in snapshot order. When users are
+    sorted by join date, only the users at the end of the snapshot that
+    joined after start_date are looked at.
+
+    :param snapshot: snapshot to search, see snapshot_from_dict
+    :type snapshot: dict
+    :param start_date: start of the window (exclusive) as ISO_DATE_FMT
+    :type start_date: str
+    :param end_date: end of the window (inclusive) as ISO_DATE_FMT, unbounded if not given
+    :type end_date: str, optional
+    :return: (user name, user record) pairs
+    :rtype: Iterator[Tuple[str, UserRecord]]
+    """
+    users = snapshot["users"].items()
+
+    if snapshot.get("users_sorted_by_join_date", False):
+        joined_after_start = list()
+        for u_name, u_info in reversed(users):
+            if u_info.join_date_iso is None or u_info.join_date_iso <= start_date:
+                break
+
+            joined_after_start.append((u_name, u_info))
+
+        users = reversed(joined_after_start)
+
+    for u_name, u_info in users:
+        # join_date is not present for some users (for example onces that are
+        # part of groups other than root.osg)
+        join_date_iso = u_info.join_date_iso
+        if join_date_iso is not None and start_date < join_date_iso \
+                and (end_date is None or join_date_iso <= end_date):
+            yield u_name, u_info
+
+def iter_new_account_requests(prev_snapshot: dict, curr_snapshot: dict) -> Iterator[str]:
+    """
+    Yields the same users as get_new_account_requests without building a list,
+    for callers that only go over them once.
+
+    :param prev_snapshot: snapshot previously recorded
+    :type prev_snapshot: dict
+    :param curr_snapshot: snapshot just recorded
+    :type curr_snapshot: dict
+    :return: users who had requested accounts since the last snapshot was taken, in no particular order
+    :rtype: Iterator[str]
+    """
+    # dates are compared as ISO_DATE_FMT strings
+    start_date = to_iso_date(prev_snapshot["date"])
+    end_date = to_iso_date(curr_snapshot["date"])
+
+    for u_name, _ in _iter_users_joined_between(curr_snapshot, start_date, end_date):
+        yield u_name
+
 def get_new_account_requests(prev_snapshot: dict, curr_snapshot: dict) -> List[str]:
     """
     Gets all new accounts requests that came in during
@@ -220,28 +572,77 @@ def get_new_account_requests(prev_snapshot: dict, curr_snapshot: dict) -> List[s
     :type prev_snapshot: dict
     :param curr_snapshot: snapshot just recorded
     :type curr_snapshot: dict
-    :return: list of users who had requested accounts since the last snapshot was taken
+    :return: list of users who had requested accounts since the last snapshot was taken, in no particular order
     :rtype: list
     """
-    start_date = datetime.strptime(prev_snapshot["date"], DATE_FMT)
-    end_date = datetime.strptime(curr_snapshot["date"], DATE_FMT)
+    accounts = list(iter_new_account_requests(prev_snapshot, curr_snapshot))
+    
+    log.info(
+        "found %d new account requests from %s to %s: %s",
+        len(accounts),
+        prev_snapshot["date"],
+        curr_snapshot["date"],
+        accounts
+    )
 
-    accounts = list()
-    for u_name, u_info in curr_snapshot["users"].items():
-        # join_date is not present for some users (for example onces that are
-        # part of groups other than root.osg)
-        if "join_date" in u_info:
-            join_date = datetime.strptime(u_info["join_date"], DATE_FMT)
+    return accounts
 
-            if start_date < join_date and join_date <= end_date:
-                accounts.append(u_name)
-    
-    log.info("found {n} new account requests from {start} to {end}: {acts}".format(
-        n=len(accounts),
-        start=start_date,
-        end=end_date,
-        acts=accounts
-    ))
+def classify_new_account_requests(
+        prev_snapshot: dict,
+        curr_snapshot: dict,
+        training_projects: AbstractSet[str],
+        exclude: AbstractSet[str] = DEFAULT_EXCLUDED_GROUPS
+    ) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Gets all new account requests (see get_new_account_requests) along with
+    those that have already been added to a training project and those that
+    have already been added to a non training project (see _classify_groups),
+    in a single pass over the current snapshot.
+
+    :param prev_snapshot: snapshot previously recorded
+    :type prev_snapshot: dict
+    :param curr_snapshot: snapshot just recorded
+    :type curr_snapshot: dict
+    :param training_projects: predefined set of training projects
+    :type training_projects: AbstractSet[str]
+    :param exclude: non-training projects to exclude, defaults to DEFAULT_EXCLUDED_GROUPS
+    :type exclude: AbstractSet[str], optional
+    :return: lists of users who had requested accounts, and of those, who are in a training project and who are in a non training project, in no particular order
+    :rtype: Tuple[List[str], List[str], List[str]]
+    """
+    start_date = to_iso_date(prev_snapshot["date"])
+    end_date = to_iso_date(curr_snapshot["date"])
+    excluded = exclude - training_projects
+
+    # accounts[0] is all REQUESTED accounts
+    # accounts[1] is requested accounts in a TRAINING project
+    # accounts[2] is requested accounts in a NON TRAINING project
+    accounts = (list(), list(), list())
+
+    for u_name, u_info in _iter_users_joined_between(curr_snapshot, start_date, end_date):
+        accounts[0].append(u_name)
+
+        in_training, in_non_training = _classify_groups(
+            u_info.groups,
+            training_projects,
+            excluded
+        )
+
+        if in_training:
+            accounts[1].append(u_name)
+
+        if in_non_training:
+            accounts[2].append(u_name)
+
+    log.info(
+        "found %d new account requests from %s to %s, %d in a training project and %d in a non training project: %s",
+        len(accounts[0]),
+        start_date,
+        end_date,
+        len(accounts[1]),
+        len(accounts[2]),
+        accounts[0]
+    )
 
     return accounts
 
@@ -257,38 +658,43 @@ def get_new_accounts_accepted_and_rejected(prev_snapshot: dict, curr_snapshot: d
     :type prev_snapshot: dict
     :param curr_snapshot: snapshot just recorded
     :type curr_snapshot: dict
-    :return: lists of users whos accounts have been accepted and rejected
+    :return: lists of users whos accounts have been accepted and rejected, in no particular order
     :rtype: Tuple[List[str], List[str]]
     """
-    start_date = datetime.strptime(prev_snapshot["date"], DATE_FMT)
-    end_date = datetime.strptime(curr_snapshot["date"], DATE_FMT)
+    start_date = parse_date(prev_snapshot["date"])
+    end_date = parse_date(curr_snapshot["date"])
+
+    # Enum.value is a descriptor lookup, avoid doing it for every user
+    PENDING = GroupMemberState.PENDING.value
+    ACTIVE = GroupMemberState.ACTIVE.value
 
     # accounts[0] is ACCEPTED accounts
     # accounts[1] is REJECTED accounts
     accounts = (list(), list())
 
+    curr_users = curr_snapshot["users"]
+
     # look at "root.osg" state changes from previous snapshot to current snapshot
     log.debug("looking at root.osg state changes from previous to current snapshot")
     for u_name, u_info in prev_snapshot["users"].items():
-        log.debug("working on {}".format(u_name))
         # TODO: figure out what it means to be in group root.osg
-        # not all memebers are part of "root.osg", skip those that are not 
-        try:
-            # only care about members in "root.osg" in previous snapshot
-            if "root.osg" in u_info["groups"]:
+        # only care about accounts pending in "root.osg" in previous snapshot
+        if u_info.groups.get(ROOT_OSG_GROUP) != PENDING:
+            continue
+
+        log.debug("working on %s", u_name)
+        curr_info = curr_users.get(u_name)
+        curr_state = curr_info.groups.get(ROOT_OSG_GROUP) if curr_info is not None else None
 
-                # account is accepted iff root.osg state moved from pending -> active from prev to curr snapshot
-                if u_info["groups"]["root.osg"] == GroupMemberState.PENDING.value \
-                    and curr_snapshot["users"][u_name]["groups"]["root.osg"] == GroupMemberState.ACTIVE.value:
+        # account is accepted iff root.osg state moved from pending -> active from prev to curr snapshot
+        if curr_state == ACTIVE:
+            # account was accepted!
+            accounts[0].append(u_name)
 
-                    # account was accepted!
-                    accounts[0].append(u_name)
+        # account from prev no longer in root.osg in curr, thus account was rejected
+        elif curr_state is None:
+            log.warning("%s no longer in root.osg; adding as rejected account", u_name)
 
-        # key error accessing curr_snapshot means account from prev not in curr, thus account was rejected
-        except KeyError as e:
-            # user from prev snapshot not in 
-            log.warning("problem key: {}, exception: {}; adding as rejected account".format(u_name, e))
-            
             # account was rejected!
             accounts[1].append(u_name)
 
@@ -296,40 +702,92 @@ def get_new_accounts_accepted_and_rejected(prev_snapshot: dict, curr_snapshot: d
     # current snapshot (their entries will only exist in the current snapshot and their join
     # date will be after the date of the previous snapshot)
     log.debug("looking at accounts that have been just requested and accepted between snapshots")
-    for name, info in curr_snapshot["users"].items():
-        log.debug("working on {}".format(name))
+    joined_since_prev_snapshot = _iter_users_joined_between(
+        curr_snapshot,
+        start_date.strftime(ISO_DATE_FMT)
+    )
+    for name, info in joined_since_prev_snapshot:
+        log.debug("working on %s", name)
         log.debug(info)
-        if "root.osg" in info["groups"] \
-            and info["groups"]["root.osg"] == GroupMemberState.ACTIVE.value \
-            and datetime.strptime(info["join_date"], DATE_FMT) > start_date:
+        if info.groups.get(ROOT_OSG_GROUP) == ACTIVE:
 
             # account was just accepted!
             accounts[0].append(name)    
     
     log.info(
-            "found {n} new accounts that have been accepted from {start} to {end}: {acts}".format(
-            n=len(accounts[0]),
-            start=start_date,
-            end=end_date,
-            acts=accounts[0]
-        )
+        "found %d new accounts that have been accepted from %s to %s: %s",
+        len(accounts[0]),
+        start_date,
+        end_date,
+        accounts[0]
     )
 
     log.info(
-        "found {n} new accounts that have been REJECTED from {start} to {end}: {acts}".format(
-            n=len(accounts[1]),
-            start=start_date,
-            end=end_date,
-            acts=accounts[1]
-        )
+        "found %d new accounts that have been REJECTED from %s to %s: %s",
+        len(accounts[1]),
+        start_date,
+        end_date,
+        accounts[1]
     )
 
     return accounts
 
+def build_active_group_index(
+        snapshot: dict,
+        users: Optional[Iterable[str]] = None
+    ) -> Dict[str, FrozenSet[str]]:
+    """
+    Maps users to the set of groups in which they are active or pending, so
+    that questions about which groups a user has been added to become set
+    operations.
+
+    :param snapshot: snapshot to index
+    :type snapshot: dict
+    :param users: users to index, defaults to all users in the snapshot
+    :type users: Iterable[str], optional
+    :return: mapping of user name to the groups they are active or pending in
+    :rtype: Dict[str, FrozenSet[str]]
+    """
+    snapshot_users = snapshot["users"]
+    if users is None:
+        users = snapshot_users.keys()
+
+    return {
+        user: frozenset(
+            group_name
+            for group_name, state in snapshot_users[user].groups.items()
+            if state in ACTIVE_OR_PENDING
+        )
+        for user in users
+    }
+
+def tag_training_groups(snapshot: dict, training_projects: AbstractSet[str]) -> Dict[str, bool]:
+    """
+    Tags every group that appears in the snapshot with whether or not it is a
+    training project, so that callers classifying many users only need to look
+    each group up in the tags.
+
+    :param snapshot: snapshot whose groups should be tagged
+    :type snapshot: dict
+    :param training_projects: predefined set of training projects
+    :type training_projects: AbstractSet[str]
+    :return: mapping of group name to whether it is a training project
+    :rtype: Dict[str, bool]
+    """
+    tags = dict()
+
+    for u_info in snapshot["users"].values():
+        for group_name in u_info.groups:
+            if group_name not in tags:
+                tags[group_name] = group_name in training_projects
+
+    return tags
+
 def get_new_accounts_accepted_in_training_group(
         new_acts_accepted: List[str], 
-        curr_snapshot: dict, 
-        training_projects: Set[str]
+        curr_snapshot: Optional[dict], 
+        training_projects: AbstractSet[str],
+        curr_index: Optional[Dict[str, FrozenSet[str]]] = None
     ) -> List[str]:
     """
     Gets all accounts that have been accepted and added to a training project.
@@ -338,40 +796,38 @@ def get_new_accounts_accepted_in_training_group(
 
     :param new_acts_accepted: new accounts accepted since the last snapshot was taken
     :type new_acts_accepted: List[str]
-    :param curr_snapshot: snapshot just recorded
-    :type curr_snapshot: dict
+    :param curr_snapshot: snapshot just recorded, only read when curr_index is not given
+    :type curr_snapshot: dict, optional
     :param training_projects: predefined set of training projects to search for
-    :type training_projects: Set[str]
-    :return: list of users whos accounts have been accepted and added to a training project
+    :type training_projects: AbstractSet[str]
+    :param curr_index: build_active_group_index of curr_snapshot, built for new_acts_accepted if not given
+    :type curr_index: Dict[str, FrozenSet[str]], optional
+    :return: list of users whos accounts have been accepted and added to a training project, in no particular order
     :rtype: List[str]
     """
+    if curr_index is None:
+        curr_index = build_active_group_index(curr_snapshot, new_acts_accepted)
 
-    accounts = list()
-
-    for user in new_acts_accepted:
-        user_groups = curr_snapshot["users"][user]["groups"]
-
-        for group_name, state in user_groups.items():
-            if group_name in training_projects and\
-                state in {GroupMemberState.ACTIVE.value, GroupMemberState.PENDING.value}:
-
-                accounts.append(user)
-                break
+    accounts = [
+        user for user in new_acts_accepted
+        if not curr_index[user].isdisjoint(training_projects)
+    ]
 
     log.info(
-            "found {n} accounts that have been accepted and added to a training project: {acts}".format(
-            n=len(accounts),
-            acts=accounts
-        )
+        "found %d accounts that have been accepted and added to a training project: %s",
+        len(accounts),
+        accounts
     )
 
     return accounts
 
 def get_new_accounts_accepted_in_non_training_group(
         new_acts_accepted: List[str],
-        curr_snapshot: dict, 
-        training_projects: Set[str], 
-        exclude: Set[str] = {"root", "root.osg", "root.osg.login-nodes", "root.osg.login-nodes.login05", "root.osg.login-nodes.login04"}
+        curr_snapshot: Optional[dict], 
+        training_projects: Optional[AbstractSet[str]] = None, 
+        exclude: AbstractSet[str] = DEFAULT_EXCLUDED_GROUPS,
+        curr_index: Optional[Dict[str, FrozenSet[str]]] = None,
+        training_tags: Optional[Dict[str, bool]] = None
     ) -> List[str]:
     """
     Gets all accounts that have been accepted since the last snapshot and have
@@ -379,36 +835,150 @@ def get_new_accounts_accepted_in_non_training_group(
     defined as showing up as a member in a group that is neither in any of the 
     groups in "exclude" and "training_projects" and having a group state=<active | pending>.
 
+    :param new_acts_accepted: new accounts accepted since the last snapshot was taken
+    :type new_acts_accepted: List[str]
+    :param curr_snapshot: snapshot just recorded, only read when curr_index is not given
+    :type curr_snapshot: dict, optional
+    :param training_projects: predefiend set of training projects to exclude, required unless training_tags is given
+    :type training_projects: AbstractSet[str], optional
+    :param exclude: non-training projects to exclude, defaults to DEFAULT_EXCLUDED_GROUPS
+    :type exclude: AbstractSet[str], optional
+    :param curr_index: build_active_group_index of curr_snapshot, built for new_acts_accepted if not given
+    :type curr_index: Dict[str, FrozenSet[str]], optional
+    :param training_tags: tag_training_groups of curr_snapshot, must cover every group in curr_index; training_projects is ignored if given
+    :type training_tags: Dict[str, bool], optional
+    :return: list of users whos accounts have been accepted and added to a non training project, in no particular order
+    :rtype: List[str]
+    :raises ValueError: neither training_projects nor training_tags is given
+    """
+    if curr_index is None:
+        curr_index = build_active_group_index(curr_snapshot, new_acts_accepted)
+
+    # a user is in a non training group iff some active/pending group is not excluded
+    if training_tags is None:
+        if training_projects is None:
+            raise ValueError("one of training_projects or training_tags must be given")
+
+        excluded = exclude | training_projects
+
+        accounts = [
+            user for user in new_acts_accepted
+            if not curr_index[user] <= excluded
+        ]
+
+        log.info(
+            "found %d new accounts accepted that have already been added to a non training project (excluding %s): %s",
+            len(accounts),
+            excluded,
+            accounts
+        )
+    else:
+        non_training = frozenset(
+            group_name for group_name, is_training in training_tags.items()
+            if not is_training
+        ) - exclude
+
+        accounts = [
+            user for user in new_acts_accepted
+            if not curr_index[user].isdisjoint(non_training)
+        ]
+
+        log.info(
+            "found %d new accounts accepted that have already been added to a non training project (any of %s): %s",
+            len(accounts),
+            non_training,
+            accounts
+        )
+
+    return accounts
+
+def _classify_groups(
+        user_groups: Dict[str, str],
+        training_projects: AbstractSet[str],
+        excluded: AbstractSet[str]
+    ) -> Tuple[bool, bool]:
+    """
+    Determines whether a user has been added to a training project and/or a
+    non-training project in a single pass over their groups.
+
+    :param user_groups: mapping of group name to the user's state in that group
+    :type user_groups: Dict[str, str]
+    :param training_projects: predefined set of training projects
+    :type training_projects: AbstractSet[str]
+    :param excluded: groups that count as neither, must not contain any training projects
+    :type excluded: AbstractSet[str]
+    :return: whether the user is in a training project and whether they are in a non-training project
+    :rtype: Tuple[bool, bool]
+    """
+    in_training = False
+    in_non_training = False
+
+    for group_name, state in user_groups.items():
+        if state not in ACTIVE_OR_PENDING:
+            continue
+
+        if group_name in training_projects:
+            in_training = True
+        elif group_name not in excluded:
+            in_non_training = True
+
+        if in_training and in_non_training:
+            break
+
+    return in_training, in_non_training
+
+def classify_new_accounts_accepted(
+        new_acts_accepted: List[str],
+        curr_snapshot: dict,
+        training_projects: AbstractSet[str],
+        exclude: AbstractSet[str] = DEFAULT_EXCLUDED_GROUPS
+    ) -> Tuple[List[str], List[str]]:
+    """
+    Computes both get_new_accounts_accepted_in_training_group and
+    get_new_accounts_accepted_in_non_training_group while only going over
+    each user's groups once.
+
     :param new_acts_accepted: new accounts accepted since the last snapshot was taken
     :type new_acts_accepted: List[str]
     :param curr_snapshot: snapshot just recorded
     :type curr_snapshot: dict
-    :param training_projects: predefiend set of training projects to exclude
-    :type training_projects: Set[str]
-    :param exclude: non-training projects to exclude, defaults to {"root", "root.osg", "root.osg.login-nodes", "root.osg.login-nodes.login05", "root.osg.login-nodes.login04"}
-    :type exclude: Set[str], optional
-    :return: list of users whos accounts have been accepted and added to a non training project
-    :rtype: List[str]
+    :param training_projects: predefined set of training projects
+    :type training_projects: AbstractSet[str]
+    :param exclude: non-training projects to exclude, defaults to DEFAULT_EXCLUDED_GROUPS
+    :type exclude: AbstractSet[str], optional
+    :return: lists of users whos accounts have been accepted and added to a training project and to a non training project, in no particular order
+    :rtype: Tuple[List[str], List[str]]
     """
-    exclude.update(training_projects)
-    accounts = list()
+    excluded = exclude - training_projects
+
+    # accounts[0] is accounts in a TRAINING project
+    # accounts[1] is accounts in a NON TRAINING project
+    accounts = (list(), list())
 
     for user in new_acts_accepted:
-        user_groups = curr_snapshot["users"][user]["groups"]
+        in_training, in_non_training = _classify_groups(
+            curr_snapshot["users"][user].groups,
+            training_projects,
+            excluded
+        )
 
-        for group_name, state in user_groups.items():
-            if group_name not in exclude and\
-                state in {GroupMemberState.ACTIVE.value, GroupMemberState.PENDING.value}:
+        if in_training:
+            accounts[0].append(user)
+
+        if in_non_training:
+            accounts[1].append(user)
 
-                accounts.append(user)
-                break
-    
     log.info(
-            "found {n} new accounts accepted that have already been added to a non training project (excluding {excluded}): {acts}".format(
-            n=len(accounts),
-            excluded=exclude,
-            acts=accounts
-        )
+        "found %d accounts that have been accepted and added to a training project: %s",
+        len(accounts[0]),
+        accounts[0]
+    )
+
+    log.info(
+        "found %d new accounts accepted that have already been added to a non training project (excluding %s): %s",
+        len(accounts[1]),
+        exclude,
+        accounts[1]
     )
 
     return accounts
@@ -461,7 +1031,7 @@ if __name__=="__main__":
 
     if args.start:
         previous_snapshot = get_snapshot_on_disk(args.start)
-        log.info("using start snapshot: {}".format(args.start))
+        log.info("using start snapshot: %s", args.start)
     else:
         previous_snapshot_file = get_latest_snapshot_on_disk()
 
@@ -469,28 +1039,33 @@ if __name__=="__main__":
             log.info("No previous snapshot found, exiting")
             sys.exit(1)
 
-        with previous_snapshot_file.open("r") as f:
-            previous_snapshot = json.load(f)
+        previous_snapshot = load_snapshot(previous_snapshot_file)
+
+    # only the root.osg state of each user is needed from the previous snapshot
+    previous_snapshot = compact_previous_snapshot(previous_snapshot)
     
     if args.end:
         current_snapshot = get_snapshot_on_disk(args.end)
-        log.info("using end snapshot: {}".format(args.end))
+        log.info("using end snapshot: %s", args.end)
     else:
-        get_snapshot(save=True)
-        with get_latest_snapshot_on_disk().open("r") as f:
-            current_snapshot = json.load(f)
+        current_snapshot = get_snapshot(save=True)
     
-    previous_snapshot_date = datetime.strptime(previous_snapshot["date"], DATE_FMT)
-    current_snapshot_date = datetime.strptime(current_snapshot["date"], DATE_FMT)
+    previous_snapshot_date = parse_date(previous_snapshot["date"])
+    current_snapshot_date = parse_date(current_snapshot["date"])
     report_duration_in_days = (current_snapshot_date - previous_snapshot_date).days
     
     training_groups = get_training_groups()
 
     # new account requests
-    new_account_requests = get_new_account_requests(
-            prev_snapshot=previous_snapshot,
-            curr_snapshot=current_snapshot
-        )
+    new_account_requests_in_training_and_non_training_group = classify_new_account_requests(
+        prev_snapshot=previous_snapshot,
+        curr_snapshot=current_snapshot,
+        training_projects=training_groups
+    )
+
+    new_account_requests = new_account_requests_in_training_and_non_training_group[0]
+    new_account_requests_in_training_group = new_account_requests_in_training_and_non_training_group[1]
+    new_account_requests_in_non_training_group = new_account_requests_in_training_and_non_training_group[2]
 
     # accounts accepted
     new_accounts_accepted_and_rejected = get_new_accounts_accepted_and_rejected(
@@ -501,23 +1076,24 @@ if __name__=="__main__":
     new_accounts_accepted = new_accounts_accepted_and_rejected[0]
     new_accounts_rejected = new_accounts_accepted_and_rejected[1]
 
-    new_accounts_accepted_in_training_group = get_new_accounts_accepted_in_training_group(
+    new_accounts_accepted_in_training_and_non_training_group = classify_new_accounts_accepted(
         new_acts_accepted=new_accounts_accepted,
         curr_snapshot=current_snapshot,
         training_projects=training_groups
     )
 
-    new_accounts_accepted_in_non_training_group = get_new_accounts_accepted_in_non_training_group(
-        new_acts_accepted=new_accounts_accepted,
-        curr_snapshot=current_snapshot,
-        training_projects=training_groups
-    )
+    new_accounts_accepted_in_training_group = new_accounts_accepted_in_training_and_non_training_group[0]
+    new_accounts_accepted_in_non_training_group = new_accounts_accepted_in_training_and_non_training_group[1]
 
     if args.recipients:
         report = """
         <p>Account Reporting: {start} to {end} ({dur} days)</p>
         <ul>
             <li>Accounts Requested: {num_nar} ({nar})</li>
+                <ul>
+                    <li>AND in Training Group: {num_nar_tr} ({nar_tr})</li>
+                    <li>AND in Non Training Group: {num_nar_ntr} ({nar_ntr})</li>
+                </ul>
             <li>Accounts Accepted: {num_naa} ({naa})</li>
                 <ul>
                     <li>AND in Training Group: {num_naa_tr} ({naa_tr})</li>
@@ -531,6 +1107,10 @@ if __name__=="__main__":
             dur=report_duration_in_days,
             num_nar=len(new_account_requests),
             nar=new_account_requests,
+            num_nar_tr=len(new_account_requests_in_training_group),
+            nar_tr=new_account_requests_in_training_group,
+            num_nar_ntr=len(new_account_requests_in_non_training_group),
+            nar_ntr=new_account_requests_in_non_training_group,
             num_naa=len(new_accounts_accepted),
             naa=new_accounts_accepted,
             num_naa_tr=len(new_accounts_accepted_in_training_group),
@@ -1,333 +1,1003 @@
+import json
+import smtplib
+
+from datetime import datetime
+from types import MappingProxyType
+from typing import FrozenSet, List, Tuple
+
+import orjson
 import pytest
 
+import generate_user_report
+
 from generate_user_report import get_new_account_requests
+from generate_user_report import iter_new_account_requests
 from generate_user_report import get_new_accounts_accepted_and_rejected
 from generate_user_report import get_new_accounts_accepted_in_training_group
 from generate_user_report import get_new_accounts_accepted_in_non_training_group
+from generate_user_report import classify_new_account_requests
+from generate_user_report import classify_new_accounts_accepted
+from generate_user_report import read_snapshot_date
+from generate_user_report import compact_previous_snapshot
+from generate_user_report import dump_snapshot
+from generate_user_report import load_snapshot
+from generate_user_report import parse_date
+from generate_user_report import get_latest_snapshot_on_disk
+from generate_user_report import get_snapshot
+from generate_user_report import send_report
+from generate_user_report import snapshot_from_dict
+from generate_user_report import UserRecord
+from generate_user_report import build_active_group_index
+from generate_user_report import tag_training_groups
+
+_TRAINING_PROJECTS = frozenset({"root.osg.training2021"})
+_EXCLUDE = frozenset({"root", "root.osg"})
+
+# dates of the previous and current snapshots used throughout the tests
+_PREV_DATE = "2021-Jan-01 00:00:01.000000 UTC"
+_CURR_DATE = "2021-Jan-07 00:00:00.000000 UTC"
+
+def _user(osg_state: str, groups: dict, join_date: str = "2021-Jan-01 00:00:00.000000 UTC") -> dict:
+    """Builds a user entry as it would be written to a snapshot"""
+    return {"osg_state": osg_state, "join_date": join_date, "groups": groups}
+
+def _read_only(snapshot: dict) -> MappingProxyType:
+    """Wraps a snapshot so that tests sharing it cannot modify it"""
+    return MappingProxyType({**snapshot, "users": MappingProxyType(snapshot["users"])})
+
+# snapshots shared by tests, stored as they would be read from disk
+_PREV_JSON = orjson.dumps({
+    "date": _PREV_DATE,
+    "users": {
+        "jim_halpert": _user("pending", {
+            "root.osg": "pending",
+            "root.osg.training2021": "pending",
+            "root.osg.non_training": "pending"
+        }),
+        "pam_beesly": _user("active", {
+            "root.osg": "active",
+            "root.osg.non_training": "active"
+        }, join_date="2021-Jan-01 04:46:25.868712 UTC")
+    }
+})
+
+_CURR_JSON = orjson.dumps({
+    "date": _CURR_DATE,
+    "users": {
+        "jim_halpert": _user("active", {
+            "root.osg": "active",
+            "root.osg.training2021": "active",
+            "root.osg.non_training": "active"
+        }),
+        "pam_beesly": _user("active", {
+            "root.osg": "active",
+            "root.osg.non_training": "active",
+            "root.osg.training2021": "pending"
+        }, join_date="2021-Jan-01 04:46:25.868712 UTC")
+    }
+})
+
+@pytest.fixture(scope="session")
+def prev_snapshot():
+    return _read_only(snapshot_from_dict(orjson.loads(_PREV_JSON)))
+
+@pytest.fixture(scope="session")
+def curr_snapshot():
+    return _read_only(snapshot_from_dict(orjson.loads(_CURR_JSON)))
+
+@pytest.fixture(scope="session")
+def curr_index(curr_snapshot):
+    return build_active_group_index(curr_snapshot)
+
+# (curr_snapshot, expected_result) cases for get_new_accounts_accepted_in_training_group
+_TRAIN_CASES: Tuple[Tuple[dict, List[str]], ...] = (
+    (
+        {
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "root.osg.training2021": "active",
+                    "root.osg.non_training": "active"
+                })
+            }
+        },
+        ["jim_halpert"]
+    ),
+    (
+        {
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "root.osg.non_training": "active"
+                })
+            }
+        },
+        [] 
+    )
+)
+_TRAIN_CASE_IDS = ["in_training", "not_in_training"]
+
+# (curr_snapshot, exclude, training_groups, expected_result) cases for
+# get_new_accounts_accepted_in_non_training_group
+_NON_TRAIN_CASES: Tuple[Tuple[dict, FrozenSet[str], FrozenSet[str], List[str]], ...] = (
+    (
+        {
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "root.osg.training2021": "active",
+                    "root.osg.non_training": "active"
+                })
+            }
+        },
+        _EXCLUDE,
+        _TRAINING_PROJECTS,
+        ["jim_halpert"]
+    ),
+    (
+        {
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "root.osg.training2021": "active"
+                })
+            }
+        },
+        _EXCLUDE,
+        _TRAINING_PROJECTS,
+        []
+    ),
+    (
+        {
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "root.osg.training2021": "active",
+                    "root.osg.non_training": "pending"
+                })
+            }
+        },
+        _EXCLUDE,
+        _TRAINING_PROJECTS,
+        ["jim_halpert"]
+    )
+)
+_NON_TRAIN_CASE_IDS = ["active_non_training", "only_training", "pending_non_training"]
 
 class TestGetNewAccountRequests: 
     @pytest.mark.parametrize(
-        "prev_snapshot, curr_snapshot",
+        "case_prev, case_curr",
         [
             (
-                {   
-                    "date": "2021-Jan-01 00:00:01.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "pending",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "pending",
-                                "root.osg.training2021": "pending",
-                                "root.osg.non_training": "pending"
-                            }
-                        },
-                        "pam_beesly": {
-                            "osg_state": "active",
-                            "join_date": "2021-Jan-01 04:46:25.868712 UTC",
-                            "groups": {
-                                "root.osg": "active",
-                                "root.osg.non_training": "active"
-                            }
-                        }
-                    }
+                {
+                    "date": _PREV_DATE,
+                    "users": dict()
                 },
                 {
-                "date": "2021-Jan-07 00:00:00.000000 UTC",
+                "date": _CURR_DATE,
                 "users": {
                     "jim_halpert": {
                         "osg_state": "active",
                         "join_date": "2021-Jan-01 00:00:00.000000 UTC",
+                        "join_date_iso": "2021-01-01T00:00:00.000000",
                         "groups": {
-                            "root.osg": "active",
-                            "root.osg.training2021": "active",
-                            "root.osg.non_training": "active"
+                            "root.osg": "active"
                         }
                     },
                     "pam_beesly": {
-                        "osg_state": "active",
+                        "osg_state": "pending",
                         "join_date": "2021-Jan-01 04:46:25.868712 UTC",
+                        "join_date_iso": "2021-01-01T04:46:25.868712",
                         "groups": {
-                            "root.osg": "active",
-                            "root.osg.non_training": "active",
-                            "root.osg.training2021": "pending"
+                            "root.osg": "pending"
                         }
                     }
                 }
             }
-            )
-        ]
-    )   
-    def test_get_new_account_requests(self, prev_snapshot, curr_snapshot):
-        result = get_new_account_requests(prev_snapshot, curr_snapshot)
-        assert result == ["pam_beesly"]
-
-    @pytest.mark.parametrize(
-        "prev_snapshot, curr_snapshot, expected",
-        [
+            ),
             (
-                {   
-                    "date": "2021-Jan-01 00:00:01.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "pending",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "pending",
-                                "root.osg.training2021": "pending",
-                                "root.osg.non_training": "pending"
-                            }
-                        },
-                        "pam_beesly": {
-                            "osg_state": "active",
-                            "join_date": "2020-Jan-01 04:46:25.868712 UTC",
-                            "groups": {
-                                "root.osg": "active",
-                                "root.osg.non_training": "active"
-                            }
-                        }
-                    }
+                {
+                    "date": _PREV_DATE,
+                    "users": dict()
                 },
                 {
-                "date": "2021-Jan-07 00:00:00.000000 UTC",
+                "date": "2021-01-07T00:00:00.000000",
                 "users": {
+                    "dwight_schrute": {
+                        "osg_state": "active",
+                        "join_date": "2020-Jan-01 00:00:00.000000 UTC",
+                        "join_date_iso": "2020-01-01T00:00:00.000000",
+                        "groups": {
+                            "root.osg": "active"
+                        }
+                    },
                     "jim_halpert": {
                         "osg_state": "active",
                         "join_date": "2021-Jan-01 00:00:00.000000 UTC",
+                        "join_date_iso": "2021-01-01T00:00:00.000000",
                         "groups": {
-                            "root.osg": "active",
-                            "root.osg.training2021": "active",
-                            "root.osg.non_training": "active"
+                            "root.osg": "active"
                         }
                     },
                     "pam_beesly": {
-                        "osg_state": "active",
-                        "join_date": "2020-Jan-01 04:46:25.868712 UTC",
+                        "osg_state": "pending",
+                        "join_date": "2021-Jan-01 04:46:25.868712 UTC",
+                        "join_date_iso": "2021-01-01T04:46:25.868712",
                         "groups": {
-                            "root.osg": "active",
-                            "root.osg.non_training": "active",
-                            "root.osg.training2021": "pending"
+                            "root.osg": "pending"
                         }
                     }
                 }
-            },
-            (["jim_halpert"],[])
+            }
             ),
             (
-                {   
-                    "date": "2021-Jan-01 00:00:01.000000 UTC",
+                {
+                    "date": _PREV_DATE,
                     "users": dict()
                 },
                 {
-                "date": "2021-Jan-07 00:00:00.000000 UTC",
+                "date": "2021-01-07T00:00:00.000000",
                 "users": {
+                    "pam_beesly": {
+                        "osg_state": "pending",
+                        "join_date": "2021-Jan-01 04:46:25.868712 UTC",
+                        "join_date_iso": "2021-01-01T04:46:25.868712",
+                        "groups": {
+                            "root.osg": "pending"
+                        }
+                    },
                     "jim_halpert": {
                         "osg_state": "active",
-                        "join_date": "2021-Jan-02 00:00:00.000000 UTC",
+                        "join_date": "2021-Jan-01 00:00:00.000000 UTC",
+                        "join_date_iso": "2021-01-01T00:00:00.000000",
+                        "groups": {
+                            "root.osg": "active"
+                        }
+                    },
+                    "michael_scott": {
                         "groups": {
-                            "root.osg": "active",
-                            "root.osg.training2021": "active",
                             "root.osg.non_training": "active"
                         }
                     }
                 }
+            }
+            )
+        ]
+    )   
+    def test_get_new_account_requests_join_date_iso(self, case_prev, case_curr):
+        result = get_new_account_requests(
+            snapshot_from_dict(case_prev),
+            snapshot_from_dict(case_curr)
+        )
+        assert sorted(result) == sorted(["pam_beesly"])
+
+    def test_get_new_account_requests(self, prev_snapshot, curr_snapshot):
+        result = get_new_account_requests(prev_snapshot, curr_snapshot)
+        assert sorted(result) == sorted(["pam_beesly"])
+
+    def test_iter_new_account_requests(self, prev_snapshot, curr_snapshot):
+        result = iter_new_account_requests(prev_snapshot, curr_snapshot)
+        assert sorted(result) == sorted(["pam_beesly"])
+
+    @pytest.mark.parametrize(
+        "impl",
+        [
+            get_new_account_requests,
+            lambda prev, curr: list(iter_new_account_requests(prev, curr)),
+            lambda prev, curr: classify_new_account_requests(prev, curr, _TRAINING_PROJECTS)[0]
+        ],
+        ids=["get", "iter", "classify"]
+    )
+    @pytest.mark.parametrize(
+        "users_sorted_by_join_date",
+        [True, False],
+        ids=["bounded_scan", "full_scan"]
+    )
+    def test_new_account_requests_implementations_agree(self, impl, users_sorted_by_join_date):
+        # given in join date order, users without a join date first
+        users = [
+            ("michael_scott", {"groups": {"root.osg.non_training": "active"}}),
+            ("dwight_schrute", {"join_date": "2020-Jan-01 00:00:00.000000 UTC"}),
+            ("pam_beesly", {"join_date": "2021-Jan-02 00:00:00.000000 UTC"}),
+            ("jim_halpert", {"join_date": "2021-Jan-03 00:00:00.000000 UTC"}),
+            ("kevin_malone", {"join_date": "2021-Jan-08 00:00:00.000000 UTC"})
+        ]
+        if not users_sorted_by_join_date:
+            users.reverse()
+
+        prev_snapshot = snapshot_from_dict({
+            "date": _PREV_DATE,
+            "users": dict()
+        })
+        curr_snapshot = snapshot_from_dict({
+            "date": _CURR_DATE,
+            "users": dict(users)
+        })
+        assert curr_snapshot["users_sorted_by_join_date"] == users_sorted_by_join_date
+
+        result = impl(prev_snapshot, curr_snapshot)
+        assert sorted(result) == sorted(["pam_beesly", "jim_halpert"])
+
+    def test_classify_new_account_requests(self):
+        prev_snapshot = {
+            "date": _PREV_DATE,
+            "users": dict()
+        }
+        curr_snapshot = {
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "root.osg.training2021": "active"
+                }),
+                "pam_beesly": _user("pending", {
+                    "root.osg": "pending",
+                    "root.osg.training2021": "pending",
+                    "root.osg.non_training": "pending"
+                }, join_date="2021-Jan-02 00:00:00.000000 UTC"),
+                "dwight_schrute": _user("pending", {
+                    "root.osg": "pending",
+                    "root.osg.non_training": "active"
+                }, join_date="2021-Jan-03 00:00:00.000000 UTC")
+            }
+        }
+
+        result = classify_new_account_requests(
+            prev_snapshot=snapshot_from_dict(prev_snapshot),
+            curr_snapshot=snapshot_from_dict(curr_snapshot),
+            training_projects=_TRAINING_PROJECTS,
+            exclude=_EXCLUDE
+        )
+
+        assert [sorted(accounts) for accounts in result] == [
+            sorted(["pam_beesly", "dwight_schrute"]),
+            sorted(["pam_beesly"]),
+            sorted(["pam_beesly", "dwight_schrute"])
+        ]
+
+    @pytest.mark.parametrize(
+        "case_prev, case_curr, expected",
+        [
+            (
+                {   
+                    "date": _PREV_DATE,
+                    "users": {
+                        "jim_halpert": _user("pending", {
+                            "root.osg": "pending",
+                            "root.osg.training2021": "pending",
+                            "root.osg.non_training": "pending"
+                        }),
+                        "pam_beesly": _user("active", {
+                            "root.osg": "active",
+                            "root.osg.non_training": "active"
+                        }, join_date="2020-Jan-01 04:46:25.868712 UTC")
+                    }
+                },
+                {
+                "date": _CURR_DATE,
+                "users": {
+                    "jim_halpert": _user("active", {
+                        "root.osg": "active",
+                        "root.osg.training2021": "active",
+                        "root.osg.non_training": "active"
+                    }),
+                    "pam_beesly": _user("active", {
+                        "root.osg": "active",
+                        "root.osg.non_training": "active",
+                        "root.osg.training2021": "pending"
+                    }, join_date="2020-Jan-01 04:46:25.868712 UTC")
+                }
+            },
+            (["jim_halpert"],[])
+            ),
+            (
+                {   
+                    "date": _PREV_DATE,
+                    "users": dict()
+                },
+                {
+                "date": _CURR_DATE,
+                "users": {
+                    "jim_halpert": _user("active", {
+                        "root.osg": "active",
+                        "root.osg.training2021": "active",
+                        "root.osg.non_training": "active"
+                    }, join_date="2021-Jan-02 00:00:00.000000 UTC")
+                }
             },
             (["jim_halpert"],[])    
             ),
            (
                 {   
-                    "date": "2021-Jan-01 00:00:01.000000 UTC",
+                    "date": _PREV_DATE,
                     "users": {
-                        "jim_halpert": {
-                            "osg_state": "pending",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "pending",
-                                "root.osg.training2021": "pending",
-                                "root.osg.non_training": "pending"
-                            }
-                        },
+                        "jim_halpert": _user("pending", {
+                            "root.osg": "pending",
+                            "root.osg.training2021": "pending",
+                            "root.osg.non_training": "pending"
+                        }),
                     }
                 },
                 {
-                "date": "2021-Jan-07 00:00:00.000000 UTC",
+                "date": _CURR_DATE,
                 "users": dict()
             },
             ([],["jim_halpert"])
             ),
            (
                 {   
-                    "date": "2021-Jan-01 00:00:01.000000 UTC",
+                    "date": _PREV_DATE,
                     "users": {
-                        "jim_halpert": {
-                            "osg_state": "pending",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "pending",
-                                "root.osg.training2021": "pending",
-                                "root.osg.non_training": "pending"
-                            }
-                        },
+                        "jim_halpert": _user("pending", {
+                            "root.osg": "pending",
+                            "root.osg.training2021": "pending",
+                            "root.osg.non_training": "pending"
+                        }),
                     }
                 },
                 {
-                "date": "2021-Jan-07 00:00:00.000000 UTC",
-                "users": dict()
+                "date": _CURR_DATE,
+                "users": {
+                    "jim_halpert": _user("pending", dict()),
+                }
             },
             ([],["jim_halpert"])
             ),
            (
                 {   
-                    "date": "2021-Jan-01 00:00:01.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "pending",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "pending",
-                                "root.osg.training2021": "pending",
-                                "root.osg.non_training": "pending"
-                            }
-                        },
-                    }
+                    "date": _PREV_DATE,
+                    "users": dict()
                 },
                 {
-                "date": "2021-Jan-07 00:00:00.000000 UTC",
+                "date": _CURR_DATE,
                 "users": {
-                    "jim_halpert": {
-                        "osg_state": "pending",
-                        "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                        "groups": dict()
-                    },
+                    # joined after the current snapshot date, still accepted
+                    "jim_halpert": _user("active", {
+                        "root.osg": "active"
+                    }, join_date="2021-Jan-08 00:00:00.000000 UTC"),
                 }
             },
-            ([],["jim_halpert"])
+            (["jim_halpert"],[])
             ),
         ]
     )
-    def test_get_new_accounts_accepted_and_rejected(self, prev_snapshot, curr_snapshot, expected):
-        result = get_new_accounts_accepted_and_rejected(prev_snapshot, curr_snapshot)
-        assert result == expected
+    def test_get_new_accounts_accepted_and_rejected(self, case_prev, case_curr, expected):
+        result = get_new_accounts_accepted_and_rejected(
+            snapshot_from_dict(case_prev),
+            snapshot_from_dict(case_curr)
+        )
+        assert [sorted(accounts) for accounts in result] == [sorted(accounts) for accounts in expected]
+
+    @pytest.mark.parametrize(
+        "case_snapshot, expected_result",
+        _TRAIN_CASES,
+        ids=_TRAIN_CASE_IDS
+    )
+    def test_get_new_accounts_accepted_in_training_group(self, case_snapshot, expected_result):
+        case_snapshot = snapshot_from_dict(case_snapshot)
+
+        result = get_new_accounts_accepted_in_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=None,
+            training_projects=_TRAINING_PROJECTS,
+            curr_index=build_active_group_index(case_snapshot)
+        )
+
+        assert sorted(result) == sorted(expected_result)
+
+        # without an index, one is built from the snapshot
+        result = get_new_accounts_accepted_in_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=case_snapshot,
+            training_projects=_TRAINING_PROJECTS
+        )
+
+        assert sorted(result) == sorted(expected_result)
+    
+    @pytest.mark.parametrize(
+        "case_snapshot, exclude, training_groups, expected_result",
+        _NON_TRAIN_CASES,
+        ids=_NON_TRAIN_CASE_IDS
+    )
+    def test_get_new_accepted_in_non_training_group(
+            self, 
+            case_snapshot, 
+            exclude,
+            training_groups,
+            expected_result
+        ):
+        case_snapshot = snapshot_from_dict(case_snapshot)
+        curr_index = build_active_group_index(case_snapshot)
+
+        result = get_new_accounts_accepted_in_non_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=None,
+            training_projects=training_groups,
+            exclude=exclude,
+            curr_index=curr_index
+        )
+
+        assert sorted(result) == sorted(expected_result)
+
+        result = get_new_accounts_accepted_in_non_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=None,
+            exclude=exclude,
+            curr_index=curr_index,
+            training_tags=tag_training_groups(case_snapshot, training_groups)
+        )
+
+        assert sorted(result) == sorted(expected_result)
+
+        # without an index, one is built from the snapshot
+        result = get_new_accounts_accepted_in_non_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=case_snapshot,
+            training_projects=training_groups,
+            exclude=exclude
+        )
+
+        assert sorted(result) == sorted(expected_result)
+
+    def test_get_new_accounts_accepted_shared_index(self, curr_snapshot, curr_index):
+        result = get_new_accounts_accepted_in_training_group(
+            new_acts_accepted=["jim_halpert", "pam_beesly"],
+            curr_snapshot=curr_snapshot,
+            training_projects=_TRAINING_PROJECTS,
+            curr_index=curr_index
+        )
+
+        assert sorted(result) == sorted(["jim_halpert", "pam_beesly"])
+
+        result = get_new_accounts_accepted_in_non_training_group(
+            new_acts_accepted=["jim_halpert", "pam_beesly"],
+            curr_snapshot=curr_snapshot,
+            training_projects=_TRAINING_PROJECTS,
+            exclude=_EXCLUDE,
+            curr_index=curr_index
+        )
+
+        assert sorted(result) == sorted(["jim_halpert", "pam_beesly"])
+
+    def test_get_new_accepted_in_non_training_group_tags_override_training_projects(self):
+        curr_snapshot = snapshot_from_dict({
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "root.osg.training2021": "active",
+                    "root.osg.non_training": "active"
+                })
+            }
+        })
+
+        # tags that disagree with _TRAINING_PROJECTS about root.osg.non_training
+        training_tags = tag_training_groups(
+            curr_snapshot,
+            _TRAINING_PROJECTS | {"root.osg.non_training"}
+        )
+
+        result = get_new_accounts_accepted_in_non_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=curr_snapshot,
+            training_projects=_TRAINING_PROJECTS,
+            exclude=_EXCLUDE,
+            training_tags=training_tags
+        )
+
+        assert result == []
+
+        with pytest.raises(ValueError):
+            get_new_accounts_accepted_in_non_training_group(
+                new_acts_accepted=["jim_halpert"],
+                curr_snapshot=curr_snapshot
+            )
+
+    def test_get_new_accepted_in_non_training_group_default_exclude_unchanged(self):
+        curr_snapshot = snapshot_from_dict({
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": _user("active", {
+                    "root.osg": "active",
+                    "X": "active"
+                })
+            }
+        })
+
+        result = get_new_accounts_accepted_in_non_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=curr_snapshot,
+            training_projects=frozenset({"X"})
+        )
+
+        assert result == []
+
+        # training projects of an earlier call must not leak into the default exclude
+        result = get_new_accounts_accepted_in_non_training_group(
+            new_acts_accepted=["jim_halpert"],
+            curr_snapshot=curr_snapshot,
+            training_projects=_TRAINING_PROJECTS
+        )
+
+        assert result == ["jim_halpert"]
+
     @pytest.mark.parametrize(
-        "curr_snapshot, expected_result",
+        "groups, expected",
         [
             (
                 {
-                    "date": "2021-Jan-07 00:00:00.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "active",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "active",
-                                "root.osg.training2021": "active",
-                                "root.osg.non_training": "active"
-                            }
-                        }
-                    }
+                    "root.osg": "active",
+                    "root.osg.training2021": "active",
+                    "root.osg.non_training": "pending"
                 },
-                ["jim_halpert"]
+                (["jim_halpert"], ["jim_halpert"])
             ),
             (
                 {
-                    "date": "2021-Jan-07 00:00:00.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "active",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "active",
-                                "root.osg.non_training": "active"
-                            }
-                        }
-                    }
+                    "root.osg": "active",
+                    "root.osg.training2021": "pending"
                 },
-                [] 
+                (["jim_halpert"], [])
+            ),
+            (
+                {
+                    "root.osg": "active",
+                    "root.osg.training2021": "nonmember",
+                    "root.osg.non_training": "active"
+                },
+                ([], ["jim_halpert"])
             )
         ]
     )
-    def test_get_new_accounts_accepted_in_training_group(self, curr_snapshot, expected_result):
-        result = get_new_accounts_accepted_in_training_group(
+    def test_classify_new_accounts_accepted(self, groups, expected):
+        curr_snapshot = {
+            "date": _CURR_DATE,
+            "users": {
+                "jim_halpert": {
+                    "osg_state": "active",
+                    "join_date": "2021-Jan-01 00:00:00.000000 UTC",
+                    "groups": groups
+                }
+            }
+        }
+
+        result = classify_new_accounts_accepted(
             new_acts_accepted=["jim_halpert"],
-            curr_snapshot=curr_snapshot,
-            training_projects={"root.osg.training2021"}
+            curr_snapshot=snapshot_from_dict(curr_snapshot),
+            training_projects=_TRAINING_PROJECTS,
+            exclude=_EXCLUDE
         )
 
-        assert result == expected_result
-    
+        assert [sorted(accounts) for accounts in result] == [sorted(accounts) for accounts in expected]
+
+    def test_tag_training_groups(self, curr_snapshot):
+        result = tag_training_groups(curr_snapshot, _TRAINING_PROJECTS)
+
+        assert result == {
+            "root.osg": False,
+            "root.osg.training2021": True,
+            "root.osg.non_training": False
+        }
+
+class TestReadSnapshotDate:
+    @pytest.mark.parametrize(
+        "snapshot, indent",
+        [
+            (
+                {"date": _CURR_DATE, "users": dict()},
+                1
+            ),
+            (
+                {"users": dict(), "date": _CURR_DATE},
+                None
+            )
+        ]
+    )
+    def test_read_snapshot_date(self, tmp_path, snapshot, indent):
+        snapshot_file = tmp_path / "20210107_snapshot.json"
+        with snapshot_file.open("w") as f:
+            json.dump(snapshot, f, indent=indent)
+
+        assert read_snapshot_date(snapshot_file) == _CURR_DATE
+
+class TestSnapshotFromDict:
     @pytest.mark.parametrize(
-        "curr_snapshot, exclude, training_groups, expected_result",
+        "users, expected_sorted",
         [
             (
                 {
-                    "date": "2021-Jan-07 00:00:00.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "active",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "active",
-                                "root.osg.training2021": "active",
-                                "root.osg.non_training": "active"
-                            }
-                        }
+                    "michael_scott": {"groups": {"root.osg.non_training": "active"}},
+                    "jim_halpert": {"join_date": "2021-Jan-01 00:00:00.000000 UTC"},
+                    "pam_beesly": {
+                        "join_date": "2021-Jan-01 04:46:25.868712 UTC",
+                        "join_date_iso": "2021-01-01T04:46:25.868712"
                     }
                 },
-                {"root", "root.osg"},
-                {"root.osg.training2021"},
-                ["jim_halpert"]
+                True
             ),
             (
                 {
-                    "date": "2021-Jan-07 00:00:00.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "active",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "active",
-                                "root.osg.training2021": "active",
-                            }
+                    "pam_beesly": {"join_date": "2021-Jan-01 04:46:25.868712 UTC"},
+                    "jim_halpert": {"join_date": "2021-Jan-01 00:00:00.000000 UTC"}
+                },
+                False
+            )
+        ]
+    )
+    def test_snapshot_from_dict(self, users, expected_sorted):
+        result = snapshot_from_dict({"date": "2021-01-07T00:00:00.000000", "users": users})
+
+        assert result["users_sorted_by_join_date"] == expected_sorted
+        assert result["users"]["jim_halpert"].join_date_iso == "2021-01-01T00:00:00.000000"
+        assert result["users"]["pam_beesly"].join_date_iso == "2021-01-01T04:46:25.868712"
+
+class TestCompactPreviousSnapshot:
+    def test_compact_previous_snapshot(self):
+        snapshot = {
+            "date": _PREV_DATE,
+            "users": {
+                "jim_halpert": _user("pending", {
+                    "root.osg": "pending",
+                    "root.osg.training2021": "pending"
+                }),
+                "pam_beesly": {
+                    "groups": {
+                        "root.osg.non_training": "active"
+                    }
+                },
+                "dwight_schrute": {
+                    "osg_state": "active"
+                }
+            }
+        }
+
+        assert compact_previous_snapshot(snapshot_from_dict(snapshot)) == {
+            "date": _PREV_DATE,
+            "users": {
+                "jim_halpert": UserRecord(groups={"root.osg": "pending"}),
+                "pam_beesly": UserRecord(),
+                "dwight_schrute": UserRecord()
+            }
+        }
+
+class TestDumpSnapshot:
+    @pytest.mark.parametrize(
+        "snapshot",
+        [
+            {
+                "date": _CURR_DATE,
+                "users": {
+                    "jim_halpert": _user("active", {
+                        "root.osg": "active",
+                        "root.osg.training2021": "active"
+                    }),
+                    "pam_beesly": {
+                        "groups": {
+                            "root.osg.non_training": "pending"
                         }
                     }
+                }
+            },
+            {
+                "date": _CURR_DATE,
+                "users": dict()
+            }
+        ]
+    )
+    def test_dump_snapshot(self, tmp_path, snapshot):
+        snapshot_file = tmp_path / "20210107_snapshot.json"
+        dump_snapshot(snapshot, snapshot_file)
+
+        assert load_snapshot(snapshot_file) == snapshot_from_dict(snapshot)
+        assert read_snapshot_date(snapshot_file) == snapshot["date"]
+
+class TestParseDate:
+    @pytest.mark.parametrize(
+        "date",
+        [
+            "2021-Jan-01 04:46:25.868712 UTC",
+            "2021-01-01T04:46:25.868712"
+        ]
+    )
+    def test_parse_date(self, date):
+        assert parse_date(date) == datetime(2021, 1, 1, 4, 46, 25, 868712)
+
+class TestGetLatestSnapshotOnDisk:
+    @pytest.mark.parametrize(
+        "snapshots, expected",
+        [
+            (
+                {
+                    "20210401_snapshot.json": "2021-04-01T00:00:00.000000",
+                    "20210412_snapshot.json": "2021-Apr-12 00:00:00.000000 UTC",
+                    "20210409_snapshot.json": "2021-04-09T00:00:00.000000"
                 },
-                {"root", "root.osg"},
-                {"root.osg.training2021"},
-                []
+                "20210412_snapshot.json"
             ),
             (
                 {
-                    "date": "2021-Jan-07 00:00:00.000000 UTC",
-                    "users": {
-                        "jim_halpert": {
-                            "osg_state": "active",
-                            "join_date": "2021-Jan-01 00:00:00.000000 UTC",
-                            "groups": {
-                                "root.osg": "active",
-                                "root.osg.training2021": "active",
-                                "root.osg.non_training": "pending"
-                            }
-                        }
-                    }
+                    "20210401_snapshot.json": "2021-04-01T00:00:00.000000",
+                    "old_snapshot.json": "2021-Apr-12 00:00:00.000000 UTC",
+                    "20210409_snapshot.json": "2021-04-09T00:00:00.000000"
                 },
-                {"root", "root.osg"},
-                {"root.osg.training2021"},
-                ["jim_halpert"]
+                "old_snapshot.json"
+            ),
+            (
+                dict(),
+                None
             )
         ]
     )
-    def test_get_new_accepted_in_non_training_group(
-            self, 
-            curr_snapshot, 
-            exclude,
-            training_groups,
-            expected_result
-        ):
-        result = get_new_accounts_accepted_in_non_training_group(
-            new_acts_accepted=["jim_halpert"],
-            curr_snapshot=curr_snapshot,
-            training_projects={"root.osg.training2021"},
-            exclude=exclude
+    def test_get_latest_snapshot_on_disk(self, tmp_path, monkeypatch, snapshots, expected):
+        monkeypatch.setattr(generate_user_report, "SNAPSHOT_DIR", tmp_path)
+        monkeypatch.setattr(generate_user_report, "_latest_snapshot_cache", (None, None))
+
+        for name, date in snapshots.items():
+            dump_snapshot({"date": date, "users": dict()}, tmp_path / name)
+
+        result = get_latest_snapshot_on_disk()
+
+        assert (result.name if result else None) == expected
+
+    def test_get_latest_snapshot_on_disk_new_snapshot(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(generate_user_report, "SNAPSHOT_DIR", tmp_path)
+        monkeypatch.setattr(generate_user_report, "_latest_snapshot_cache", (None, None))
+
+        dump_snapshot({"date": "2021-04-09T00:00:00.000000", "users": dict()}, tmp_path / "20210409_snapshot.json")
+        assert get_latest_snapshot_on_disk() == tmp_path / "20210409_snapshot.json"
+
+        # cached while nothing in the directory changes
+        assert get_latest_snapshot_on_disk() == tmp_path / "20210409_snapshot.json"
+
+        # as when get_snapshot writes a new snapshot between two calls
+        dump_snapshot({"date": "2021-04-12T00:00:00.000000", "users": dict()}, tmp_path / "20210412_snapshot.json")
+        assert get_latest_snapshot_on_disk() == tmp_path / "20210412_snapshot.json"
+
+    def test_get_latest_snapshot_on_disk_cached(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(generate_user_report, "SNAPSHOT_DIR", tmp_path)
+        monkeypatch.setattr(generate_user_report, "_latest_snapshot_cache", (None, None))
+
+        dump_snapshot({"date": "2021-04-09T00:00:00.000000", "users": dict()}, tmp_path / "20210409_snapshot.json")
+        dump_snapshot({"date": "2021-Apr-12 00:00:00.000000 UTC", "users": dict()}, tmp_path / "old_snapshot.json")
+        assert get_latest_snapshot_on_disk() == tmp_path / "old_snapshot.json"
+
+        # snapshot dates are only read again once the set of snapshot files changes
+        def fail(snapshot_file):
+            raise AssertionError("read {}".format(snapshot_file))
+
+        monkeypatch.setattr(generate_user_report, "read_snapshot_date", fail)
+        assert get_latest_snapshot_on_disk() == tmp_path / "old_snapshot.json"
+
+class _FakeSMTP_SSL:
+    """Stands in for smtplib.SMTP_SSL, recording each instance and call made"""
+
+    instances = list()
+
+    def __init__(self, host, port):
+        self.calls = list()
+        self.messages = list()
+        _FakeSMTP_SSL.instances.append(self)
+
+    def login(self, user, password):
+        self.calls.append("login")
+
+    def send_message(self, message):
+        self.calls.append("send_message")
+        self.messages.append(message)
+
+    def quit(self):
+        self.calls.append("quit")
+
+    def close(self):
+        self.calls.append("close")
+
+class _FailingLoginSMTP_SSL(_FakeSMTP_SSL):
+    def login(self, user, password):
+        super().login(user, password)
+        raise smtplib.SMTPAuthenticationError(535, b"bad credentials")
+
+class TestSendReport:
+    @pytest.fixture(autouse=True)
+    def fake_password(self, monkeypatch):
+        monkeypatch.setattr(generate_user_report, "get_email_password", lambda: "password")
+        monkeypatch.setattr(_FakeSMTP_SSL, "instances", list())
+
+    def test_send_report(self, monkeypatch):
+        monkeypatch.setattr(smtplib, "SMTP_SSL", _FakeSMTP_SSL)
+
+        send_report(["jim@dundermifflin.com", "pam@dundermifflin.com"], "<p>report</p>")
+
+        assert len(_FakeSMTP_SSL.instances) == 1
+        server = _FakeSMTP_SSL.instances[0]
+        assert server.calls == ["login", "send_message", "quit"]
+        assert server.messages[0]["To"] == "jim@dundermifflin.com,pam@dundermifflin.com"
+
+    def test_send_report_login_failure(self, monkeypatch):
+        monkeypatch.setattr(smtplib, "SMTP_SSL", _FailingLoginSMTP_SSL)
+
+        with pytest.raises(smtplib.SMTPAuthenticationError):
+            send_report(["jim@dundermifflin.com"], "<p>report</p>")
+
+        assert _FakeSMTP_SSL.instances[0].calls == ["login", "close"]
+
+class _FakeUserApiClient:
+    """Stands in for UserApiClient, serving group members from GROUP_MEMBERS"""
+
+    GROUP_MEMBERS = {
+        "root.osg": [
+            {"user_name": "jim_halpert", "state": "active"},
+            {"user_name": "pam_beesly", "state": "pending"}
+        ],
+        "root.osg.training2021": [
+            {"user_name": "pam_beesly", "state": "pending"}
+        ],
+        "root.osg.non_training": [
+            {"user_name": "jim_halpert", "state": "active"},
+            {"user_name": "michael_scott", "state": "active"}
+        ]
+    }
+
+    def __init__(self, token_file_path, pool_size=16):
+        pass
+
+    def get_users(self):
+        return [
+            {"kind": "User", "metadata": {"unix_name": "jim_halpert", "join_date": "2021-Jan-02 00:00:00.000000 UTC"}},
+            {"kind": "user", "metadata": {"unix_name": "pam_beesly", "join_date": "2021-Jan-01 04:46:25.868712 UTC"}},
+            {"kind": "User", "metadata": {"unix_name": "michael_scott", "join_date": "2020-Jan-01 00:00:00.000000 UTC"}}
+        ]
+
+    def get_group_list(self):
+        return ["root", *self.GROUP_MEMBERS]
+
+    def get_group_members(self, group_name):
+        return self.GROUP_MEMBERS[group_name]
+
+class _FailingUserApiClient(_FakeUserApiClient):
+    def get_group_members(self, group_name):
+        if group_name == "root.osg.non_training":
+            raise RuntimeError("API unavailable")
+
+        return super().get_group_members(group_name)
+
+class TestGetSnapshot:
+    def test_get_snapshot(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(generate_user_report, "UserApiClient", _FakeUserApiClient)
+        monkeypatch.setattr(generate_user_report, "SNAPSHOT_DIR", tmp_path)
+
+        snapshot = get_snapshot()
+
+        snapshot_files = list(tmp_path.iterdir())
+        assert len(snapshot_files) == 1
+
+        # the snapshot returned is the one written
+        assert snapshot == load_snapshot(snapshot_files[0])
+        users = snapshot["users"]
+
+        # members of a root.osg subgroup that are not in root.osg get only groups
+        assert users["michael_scott"] == UserRecord(groups={"root.osg.non_training": "active"})
+        assert users["jim_halpert"] == UserRecord(
+            groups={"root.osg": "active", "root.osg.non_training": "active"},
+            osg_state="active",
+            join_date="2021-Jan-02 00:00:00.000000 UTC",
+            join_date_iso="2021-01-02T00:00:00.000000"
         )
+        assert users["pam_beesly"].join_date_iso == "2021-01-01T04:46:25.868712"
+        assert users["pam_beesly"].groups == {"root.osg": "pending", "root.osg.training2021": "pending"}
+
+        assert list(users) == ["michael_scott", "pam_beesly", "jim_halpert"]
+        assert snapshot["users_sorted_by_join_date"]
+
+    def test_get_snapshot_api_error(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(generate_user_report, "UserApiClient", _FailingUserApiClient)
+        monkeypatch.setattr(generate_user_report, "SNAPSHOT_DIR", tmp_path)
+
+        with pytest.raises(RuntimeError):
+            get_snapshot()
 
-        assert result == expected_result
+        assert list(tmp_path.iterdir()) == []